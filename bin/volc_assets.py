@@ -0,0 +1,212 @@
+#!/usr/bin/env python
+""" volc_assets: images for the volcano pages
+
+The data files can point at a photo of the volcano (VOLCIMAGE)
+and at raw and interpreted interferograms (RAWIMAGE and
+INTERPIMAGE). An AssetStore copies each of these into a single
+image directory under a name made from the SHA-1 of its
+contents, so an image used by several volcanoes is only stored
+(and downloaded by the browser) once, and a changed image gets
+a new name that no cache can confuse with the old one.
+
+Only the header of each PNG or JPEG file is read to find its
+width and height, which lets the pages give sized, lazy loading
+<img> tags. A record of what has been stored is kept in
+assets.json in the image directory; a source image whose size
+and modification time have not changed since it was stored is
+not read again, and a stored image is never copied twice
+(unless it has gone missing from the image directory). An image
+that cannot be read is left out and noted in errors rather than
+stopping the page that uses it.
+
+When used as a script the images named in the data files are
+stored and a line is printed for each, e.g.:
+
+    volc_assets.py ../www/images ../data/*
+"""
+
+import os
+import json
+import struct
+import shutil
+import hashlib
+import tempfile
+import threading
+
+def png_size(f):
+    """ (width, height) from the IHDR chunk of an open PNG file """
+    header = f.read(24)
+    if (len(header) < 24) or (header[:8] != "\x89PNG\r\n\x1a\n") \
+       or (header[12:16] != "IHDR"):
+        return None
+    return struct.unpack(">II", header[16:24])
+
+def jpeg_size(f):
+    """ (width, height) from the frame header of an open JPEG file """
+    if f.read(2) != "\xff\xd8":
+        return None
+    while True:
+        marker = f.read(2)
+        if (len(marker) < 2) or (marker[0] != "\xff"):
+            return None
+        code = ord(marker[1])
+        if code == 0xff:
+            # Fill byte, the marker starts one byte later
+            f.seek(-1, 1)
+            continue
+        if (code == 0x01) or (0xd0 <= code <= 0xd7):
+            # Markers with no length or data
+            continue
+        length = f.read(2)
+        if len(length) < 2:
+            return None
+        length = struct.unpack(">H", length)[0]
+        # SOF0 to SOF15, except DHT, JPG and DAC which
+        # share the range, hold the frame size.
+        if (0xc0 <= code <= 0xcf) and (code not in [0xc4, 0xc8, 0xcc]):
+            frame = f.read(5)
+            if len(frame) < 5:
+                return None
+            (precision, height, width) = struct.unpack(">BHH", frame)
+            return (width, height)
+        # Skip over this segment without reading it
+        f.seek(length-2, 1)
+
+def image_size(path):
+    """ (width, height) of a PNG or JPEG image, or None """
+    f = open(path, 'rb')
+    try:
+        size = png_size(f)
+        if size is None:
+            f.seek(0)
+            size = jpeg_size(f)
+    finally:
+        f.close()
+    return size
+
+def _file_sha1(path):
+    sha1 = hashlib.sha1()
+    f = open(path, 'rb')
+    while True:
+        block = f.read(65536)
+        if block == "":
+            break
+        sha1.update(block)
+    f.close()
+    return sha1.hexdigest()
+
+class AssetStore:
+    """ Content addressed copies of the images used by the pages """
+
+    def __init__(self, outdir, url_prefix="images/"):
+        self.outdir = outdir
+        self.url_prefix = url_prefix
+        self.index_file = os.path.join(outdir, "assets.json")
+        # images[name] holds the size of each stored image,
+        # sources[path] the stat and name of each source.
+        self.images = {}
+        self.sources = {}
+        self.copied = 0
+        self.errors = [] # (path, exception) for images left out
+        self.lock = threading.Lock()
+        if os.path.exists(self.index_file):
+            f = open(self.index_file, 'r')
+            index = json.load(f)
+            f.close()
+            self.images = index["images"]
+            self.sources = index["sources"]
+
+    def add(self, path):
+        """ Store the image at path, returns (src, width, height) """
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        with self.lock:
+            known = self.sources.get(path)
+        if (known is not None) and (known["size"] == stat.st_size) \
+           and (known["mtime"] == stat.st_mtime):
+            name = known["name"]
+        else:
+            ext = os.path.splitext(path)[1].lower()
+            name = _file_sha1(path)[:20] + ext
+        with self.lock:
+            # New images are rare so they are copied with
+            # the lock held; two volcanoes sharing a new
+            # image can then never both copy it.
+            image = self.images.get(name)
+            dest = os.path.join(self.outdir, name)
+            if (image is None) or (not os.path.exists(dest)):
+                size = image_size(path)
+                if size is None:
+                    size = (None, None)
+                if self._copy(path, dest):
+                    self.copied = self.copied + 1
+                image = {"width": size[0], "height": size[1],
+                         "bytes": stat.st_size}
+                self.images[name] = image
+        with self.lock:
+            self.sources[path] = {"size": stat.st_size,
+                                  "mtime": stat.st_mtime, "name": name}
+        return (self.url_prefix + name, image["width"], image["height"])
+
+    def add_volcano(self, volcano, filename):
+        """ Store the images of a volcano read from filename
+
+        Image paths are relative to the data file. The result
+        can be passed to volcano.html(). URLs are left alone.
+        """
+        images = {}
+        for path in [volcano.volcimage, volcano.rawimage,
+                     volcano.interpimage]:
+            if (path is None) or ("://" in path):
+                continue
+            full_path = os.path.join(os.path.dirname(filename), path)
+            try:
+                images[path] = self.add(full_path)
+            except (IOError, OSError), e:
+                # The page is still worth having without it
+                with self.lock:
+                    self.errors.append((full_path, e))
+        return images
+
+    def _copy(self, source, dest):
+        if not os.path.isdir(self.outdir):
+            os.makedirs(self.outdir)
+        if os.path.exists(dest):
+            return False
+        (dirname, basename) = os.path.split(dest)
+        (fd, tmpname) = tempfile.mkstemp(dir=dirname, prefix="."+basename)
+        os.close(fd)
+        try:
+            shutil.copyfile(source, tmpname)
+            os.chmod(tmpname, 0644)
+            os.rename(tmpname, dest)
+        except:
+            os.remove(tmpname)
+            raise
+        return True
+
+    def save(self):
+        """ Write the record of stored images to assets.json """
+        if not os.path.isdir(self.outdir):
+            os.makedirs(self.outdir)
+        with self.lock:
+            data = json.dumps({"images": self.images,
+                               "sources": self.sources},
+                              sort_keys=True, indent=2)
+        tmpname = self.index_file + ".tmp"
+        f = open(tmpname, 'w')
+        f.write(data)
+        f.close()
+        os.rename(tmpname, self.index_file)
+
+if __name__=="__main__":
+    import sys
+    from volc_def import Volcano
+    store = AssetStore(sys.argv[1])
+    for file in sys.argv[2:]:
+        volcano = Volcano(filename=file)
+        for (path, image) in store.add_volcano(volcano, file).items():
+            print file, path, image[0], image[1], image[2]
+    for (path, e) in store.errors:
+        print path, "failed:", e
+    store.save()
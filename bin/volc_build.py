@@ -0,0 +1,404 @@
+#!/usr/bin/env python
+""" volc_build: build the website pages from the data files
+
+Each data file passes through five stages: reading it from disk,
+parsing it into a Volcano, storing its images, rendering the HTML
+page and writing that page out. Rather than doing these one file at a time the
+stages run at the same time, each with its own pool of worker
+threads, joined by bounded queues. Disk reads and writes then
+overlap with parsing and rendering, and the bounded queues stop
+a fast stage running far ahead and filling memory. (Parsing and
+rendering are pure python so only one runs at a time; it is
+the I/O that we are overlapping.)
+
+Pages are written to a temporary file which is then renamed,
+so a page on the website is never seen half written. With
+--gzip (and --deflate) a compressed copy of each page is written
+next to it so the web server need not compress on every request.
+A manifest.json in the output directory records the SHA-1 and
+size of each page; a page whose bytes are unchanged since the
+last build is not rewritten or recompressed, so its mtime (and
+any cache keyed on it) stays valid. The pages of volcanoes no
+longer in the data, and their compressed copies, are removed at
+the end of the build; with --partial, when only some of the data
+files are given, they are kept. With --images the images
+named by each volcano are stored under content hash names in an
+images directory (see volc_assets) and the pages give their sizes;
+without it, or for an image that could not be stored, a page
+shows only the images given as URLs.
+With --search the name index used by the site's search box (see
+volc_search) is written to a search directory at the end.
+
+When used as a script, e.g.:
+
+    volc_build.py --parsers 2 --gzip ../www ../data/*
+
+the pages are written to the output directory and the
+throughput and queue depth of each stage is printed at the end.
+"""
+
+import os
+import time
+import json
+import gzip
+import zlib
+import hashlib
+import StringIO
+import tempfile
+import threading
+import Queue
+
+from volc_def import Volcano
+from volc_assets import AssetStore
+from volc_search import NameIndex
+
+# Put on a queue to tell one worker to stop
+_stop = object()
+
+class Stage:
+    """ One step of the build, run by a pool of worker threads """
+
+    def __init__(self, name, func, inqueue, outqueue, workers):
+        self.name = name
+        self.func = func
+        self.inqueue = inqueue
+        self.outqueue = outqueue
+        self.workers = workers
+        self.threads = []
+        self.errors = []
+        # Metrics, updated under the lock
+        self.lock = threading.Lock()
+        self.items = 0
+        self.busy = 0.0
+        self.depth_total = 0
+        self.depth_max = 0
+        self.started = None
+        self.finished = None
+
+    def start(self):
+        self.started = time.time()
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work,
+                                      name=self.name+"-"+str(i))
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def stop(self):
+        """ Wait for the work already queued to be done """
+        for thread in self.threads:
+            self.inqueue.put(_stop)
+        for thread in self.threads:
+            thread.join()
+        self.finished = time.time()
+
+    def _work(self):
+        while True:
+            depth = self.inqueue.qsize()
+            item = self.inqueue.get()
+            if item is _stop:
+                return
+            (filename, payload) = item
+            t0 = time.time()
+            try:
+                result = self.func(filename, payload)
+            except Exception, e:
+                # One bad data file should not stop the build
+                with self.lock:
+                    self.errors.append((filename, e))
+                continue
+            finally:
+                t1 = time.time()
+                with self.lock:
+                    self.items = self.items + 1
+                    self.busy = self.busy + (t1 - t0)
+                    self.depth_total = self.depth_total + depth
+                    self.depth_max = max(self.depth_max, depth)
+            if self.outqueue is not None:
+                self.outqueue.put((filename, result))
+
+    def report(self):
+        """ One line summary of what this stage did """
+        elapsed = self.finished - self.started
+        if elapsed > 0:
+            rate = self.items / elapsed
+        else:
+            rate = float('inf')
+        if self.items > 0:
+            depth_mean = float(self.depth_total) / self.items
+        else:
+            depth_mean = 0.0
+        return ("{name:8s} workers={workers} items={items} "
+                "errors={errors} busy={busy:.3f}s rate={rate:.1f}/s "
+                "queue mean={mean:.1f} max={max}").format(
+                    name=self.name, workers=self.workers,
+                    items=self.items, errors=len(self.errors),
+                    busy=self.busy, rate=rate, mean=depth_mean,
+                    max=self.depth_max)
+
+def _read(filename, payload):
+    f = open(filename, 'r')
+    lines = f.readlines()
+    f.close()
+    return lines
+
+def _render(filename, parsed):
+    (volcano, images) = parsed
+    return (volcano.id, volcano.html(images=images))
+
+def write_atomic(path, data):
+    """ Write data to path via a temporary file and a rename """
+    (dirname, basename) = os.path.split(path)
+    (fd, tmpname) = tempfile.mkstemp(dir=dirname, prefix="."+basename)
+    try:
+        f = os.fdopen(fd, 'wb')
+        f.write(data)
+        f.close()
+        # mkstemp makes the file private, pages are not
+        os.chmod(tmpname, 0644)
+        os.rename(tmpname, path)
+    except:
+        os.remove(tmpname)
+        raise
+
+def gzip_bytes(data):
+    """ Gzip data, the same bytes in give the same bytes out """
+    buf = StringIO.StringIO()
+    # No file name and a zero mtime in the header so that
+    # an unchanged page compresses to an unchanged file.
+    f = gzip.GzipFile(filename='', mode='wb', compresslevel=9,
+                      fileobj=buf, mtime=0)
+    f.write(data)
+    f.close()
+    return buf.getvalue()
+
+def deflate_bytes(data):
+    """ Raw deflate data with no zlib header or checksum
+
+    Note that HTTP's Content-Encoding: deflate means zlib wrapped
+    data, so this copy is not for serving under that name as is.
+    """
+    compressor = zlib.compressobj(9, zlib.DEFLATED, -zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+class Builder:
+    """ Pipelined build of the volcano pages into outdir """
+
+    def __init__(self, outdir, readers=2, parsers=1, image_workers=2,
+                 renderers=1, writers=2, queue_size=16, compress=False,
+                 deflate=False, images=False, search=False, prune=True):
+        self.outdir = outdir
+        self.prune = prune
+        if images:
+            self.assets = AssetStore(os.path.join(outdir, "images"))
+        else:
+            self.assets = None
+        if search:
+            self.search = NameIndex()
+        else:
+            self.search = None
+        self.compress = compress
+        self.deflate = deflate
+        self.manifest_file = os.path.join(outdir, "manifest.json")
+        self.manifest = {}
+        self.manifest_lock = threading.Lock()
+        self.manifest_changed = False
+        self.written = 0
+        self.unchanged = 0
+        self.removed = 0
+        self.built = set() # The pages this build produced
+        # One bounded queue in front of each stage
+        queues = [Queue.Queue(maxsize=queue_size) for i in range(5)]
+        self.stages = [
+            Stage("read", _read, queues[0], queues[1], readers),
+            Stage("parse", self._parse, queues[1], queues[2], parsers),
+            Stage("images", self._images, queues[2], queues[3],
+                  image_workers),
+            Stage("render", _render, queues[3], queues[4], renderers),
+            Stage("write", self._write, queues[4], None, writers)]
+
+    def _parse(self, filename, lines):
+        volcano = Volcano()
+        volcano._parse_lines(lines)
+        if volcano.id is None:
+            raise Exception("No ID in " + filename)
+        if self.search is not None:
+            self.search.add(volcano)
+        return volcano
+
+    def _images(self, filename, volcano):
+        if self.assets is None:
+            return (volcano, None)
+        return (volcano, self.assets.add_volcano(volcano, filename))
+
+    def _copies(self):
+        # The compressed copies asked for, as (suffix, the
+        # manifest key recording that it was written, how)
+        copies = []
+        if self.compress:
+            copies.append((".gz", "gzip_size", gzip_bytes))
+        if self.deflate:
+            copies.append((".deflate", "deflate_size", deflate_bytes))
+        return copies
+
+    def _unchanged(self, name, old, sha1):
+        # A page is unchanged only if the manifest says that
+        # it, and every copy asked for, were written from the
+        # same bytes and they are all still on disk.
+        if (old is None) or (old["sha1"] != sha1):
+            return False
+        outputs = [name]
+        for (suffix, key, compress) in self._copies():
+            if key not in old:
+                return False
+            outputs.append(name + suffix)
+        for output in outputs:
+            if not os.path.exists(os.path.join(self.outdir, output)):
+                return False
+        return True
+
+    def _write(self, filename, page):
+        (volc_id, html) = page
+        name = volc_id + ".html"
+        entry = {"sha1": hashlib.sha1(html).hexdigest(),
+                 "size": len(html),
+                 "source": os.path.abspath(filename)}
+        with self.manifest_lock:
+            old = self.manifest.get(name)
+            self.built.add(name)
+        if self._unchanged(name, old, entry["sha1"]):
+            with self.manifest_lock:
+                self.unchanged = self.unchanged + 1
+                # The data file may have been renamed
+                if old.get("source") != entry["source"]:
+                    old["source"] = entry["source"]
+                    self.manifest_changed = True
+            return name
+        write_atomic(os.path.join(self.outdir, name), html)
+        written = []
+        for (suffix, key, compress) in self._copies():
+            data = compress(html)
+            write_atomic(os.path.join(self.outdir, name + suffix), data)
+            entry[key] = len(data)
+            written.append(suffix)
+        # A copy not asked for this time would now be out
+        # of date, so it must not be left for the server.
+        for suffix in [".gz", ".deflate"]:
+            path = os.path.join(self.outdir, name + suffix)
+            if (suffix not in written) and os.path.exists(path):
+                os.remove(path)
+        with self.manifest_lock:
+            self.manifest[name] = entry
+            self.manifest_changed = True
+            self.written = self.written + 1
+        return name
+
+    def _load_manifest(self):
+        if os.path.exists(self.manifest_file):
+            f = open(self.manifest_file, 'r')
+            self.manifest = json.load(f)
+            f.close()
+        else:
+            self.manifest = {}
+
+    def _save_manifest(self):
+        write_atomic(self.manifest_file,
+                     json.dumps(self.manifest, sort_keys=True, indent=2))
+
+    def _prune(self):
+        # Remove the pages this build did not produce. A data
+        # file that failed this time still has a volcano in
+        # it, so the page last built from it is kept.
+        failed = set()
+        for (name, filename, e) in self.errors():
+            failed.add(os.path.abspath(filename))
+        for (name, entry) in self.manifest.items():
+            if (name in self.built) or (entry.get("source") in failed):
+                continue
+            for suffix in ["", ".gz", ".deflate"]:
+                path = os.path.join(self.outdir, name + suffix)
+                if os.path.exists(path):
+                    os.remove(path)
+            del self.manifest[name]
+            self.manifest_changed = True
+            self.removed = self.removed + 1
+
+    def build(self, filenames):
+        """ Build a page for each data file, returns the stages """
+        if not os.path.isdir(self.outdir):
+            os.makedirs(self.outdir)
+        self._load_manifest()
+        for stage in self.stages:
+            stage.start()
+        for filename in filenames:
+            self.stages[0].inqueue.put((filename, None))
+        # Stopping the stages in order means each one has
+        # seen everything the stage before it produced.
+        for stage in self.stages:
+            stage.stop()
+        if self.prune:
+            self._prune()
+        if self.manifest_changed:
+            self._save_manifest()
+        if self.assets is not None:
+            self.assets.save()
+        if self.search is not None:
+            self.search.export(os.path.join(self.outdir, "search"))
+        return self.stages
+
+    def errors(self):
+        errors = []
+        for stage in self.stages:
+            for (filename, e) in stage.errors:
+                errors.append((stage.name, filename, e))
+        return errors
+
+    def report(self):
+        lines = []
+        for stage in self.stages:
+            lines.append(stage.report())
+        lines.append("{0} pages written, {1} unchanged, {2} removed".format(
+                         self.written, self.unchanged, self.removed))
+        if self.assets is not None:
+            lines.append("{0} images copied, {1} stored".format(
+                             self.assets.copied, len(self.assets.images)))
+            for (path, e) in self.assets.errors:
+                lines.append("{0} left out: {1}".format(path, e))
+        for (name, filename, e) in self.errors():
+            lines.append("{0} failed in {1}: {2}".format(filename, name, e))
+        return "\n".join(lines)
+
+if __name__=="__main__":
+    import optparse
+    parser = optparse.OptionParser(usage="%prog [options] OUTDIR FILE...")
+    parser.add_option("--readers", type="int", default=2)
+    parser.add_option("--parsers", type="int", default=1)
+    parser.add_option("--image-workers", type="int", default=2)
+    parser.add_option("--renderers", type="int", default=1)
+    parser.add_option("--writers", type="int", default=2)
+    parser.add_option("--queue-size", type="int", default=16)
+    parser.add_option("--gzip", action="store_true", default=False,
+                      help="also write a .html.gz copy of each page")
+    parser.add_option("--deflate", action="store_true", default=False,
+                      help="also write a raw deflate .html.deflate copy")
+    parser.add_option("--images", action="store_true", default=False,
+                      help="store images under content hash names")
+    parser.add_option("--search", action="store_true", default=False,
+                      help="write the name search index")
+    parser.add_option("--partial", action="store_true", default=False,
+                      help="only some data files are given, keep the "
+                           "pages of the others")
+    (options, args) = parser.parse_args()
+    builder = Builder(args[0], readers=options.readers,
+                      parsers=options.parsers,
+                      image_workers=options.image_workers,
+                      renderers=options.renderers,
+                      writers=options.writers,
+                      queue_size=options.queue_size,
+                      compress=options.gzip, deflate=options.deflate,
+                      images=options.images, search=options.search,
+                      prune=not options.partial)
+    start = time.time()
+    builder.build(args[1:])
+    print builder.report()
+    print "Built in {0:.3f}s".format(time.time() - start)
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+""" volc_catalogue: look up volcanoes by ID without parsing them all
+
+A LazyCatalogue starts by reading each data file only as far as
+its ID line, so it costs about the same to open however long the
+files are. A volcano is parsed the first time it is asked for
+and kept in a cache of the most recently used volcanoes, which
+has a fixed size so a long running page server does not end up
+holding the whole database. Cache hits and misses are counted.
+
+Volcanoes returned by get() are shared with the cache and should
+not be changed.
+
+When used as a script the named volcanoes are dumped, e.g.:
+
+    volc_catalogue.py ../data 222110 222100
+"""
+
+import os
+import re
+import threading
+from collections import OrderedDict
+
+from volc_def import Volcano
+
+_id_re = re.compile(r"\s*ID\s*:(.+?)$", re.IGNORECASE)
+
+def scan_id(filename):
+    """ The ID of the volcano in filename, reading no further than it """
+    f = open(filename, 'r')
+    try:
+        for line in f:
+            match = _id_re.match(line)
+            if match:
+                return match.group(1).strip()
+    finally:
+        f.close()
+    return None
+
+class LazyCatalogue:
+    """ Volcanoes by ID, parsed on demand and cached """
+
+    def __init__(self, filenames, cache_size=128):
+        if cache_size < 1:
+            raise Exception("The cache must hold at least one volcano")
+        self.cache_size = cache_size
+        self.paths = {}
+        self.cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        for filename in filenames:
+            volc_id = scan_id(filename)
+            if volc_id is None:
+                # Not a volcano, e.g. a README
+                continue
+            if volc_id in self.paths:
+                raise Exception("Volcano " + volc_id + " is in both " +
+                                self.paths[volc_id] + " and " + filename)
+            self.paths[volc_id] = filename
+
+    def __len__(self):
+        return len(self.paths)
+
+    def __contains__(self, volc_id):
+        return volc_id in self.paths
+
+    def ids(self):
+        return sorted(self.paths)
+
+    def get(self, volc_id):
+        """ The Volcano with this ID, parsing it if it is not cached """
+        if volc_id not in self.paths:
+            raise KeyError(volc_id)
+        with self.lock:
+            volcano = self.cache.pop(volc_id, None)
+            if volcano is not None:
+                # Put it back as the most recently used
+                self.cache[volc_id] = volcano
+                self.hits = self.hits + 1
+                return volcano
+            self.misses = self.misses + 1
+        volcano = Volcano(filename=self.paths[volc_id])
+        with self.lock:
+            self.cache[volc_id] = volcano
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return volcano
+
+    def invalidate(self, volc_id):
+        """ Forget the cached copy of a volcano, e.g. after its file changes """
+        with self.lock:
+            self.cache.pop(volc_id, None)
+
+    def stats(self):
+        """ Cache hits, misses and size as a dictionary """
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses,
+                    "cached": len(self.cache), "volcanoes": len(self.paths)}
+
+if __name__=="__main__":
+    import sys
+    datadir = sys.argv[1]
+    filenames = [os.path.join(datadir, name)
+                 for name in sorted(os.listdir(datadir))
+                 if os.path.isfile(os.path.join(datadir, name))]
+    catalogue = LazyCatalogue(filenames)
+    for volc_id in sys.argv[2:]:
+        catalogue.get(volc_id).dump()
+    print catalogue.stats()
@@ -17,11 +17,20 @@ XML etc.) on the resulting data is undertaken.
 """
 
 import re
+import hashlib
 import datetime
 
 class Volcano:
     """ A container and processor for volcano defomation """
 
+    # The fields that make up a volcano's record, see record_hash()
+    record_field_names = ["id", "name", "latitude", "longitude",
+                          "rocktype", "typev", "region", "country",
+                          "elevation", "magnitude", "duration", "obs_freq",
+                          "method", "volcimage", "rawimage", "interpimage",
+                          "description", "references", "studies", "events",
+                          "warnings"]
+
     def __init__(self, filename=None, debug=False):
         # This is called when a new instance of
         # Volcano is created. First set all the 
@@ -32,10 +41,22 @@ class Volcano:
         self.latitude = float('NaN')
         self.longitude = float('NaN')
         self.rocktype = None
+        self.typev = None
+        self.region = None
+        self.country = None
+        self.elevation = None # Measurement, metres
+        self.magnitude = None # Measurement, cm/yr
+        self.duration = None # Measurement, years
+        self.obs_freq = None # Measurement, years
+        self.method = None
+        self.volcimage = None
+        self.rawimage = None
+        self.interpimage = None
         self.studies = []
         self.events = []
         self.references = []
         self.description = ""
+        self.warnings = [] # Values we could not make sense of
         # NOTE: put new data holders here
         #       choosing a sensible null value
 
@@ -45,6 +66,16 @@ class Volcano:
             self._parse_file(filename, debug=debug)
 
     def _parse_file(self, filename, debug=False):
+        # Read the whole file then hand the lines
+        # to the parser proper. Keeping these apart
+        # lets the build pipeline do the reading
+        # and the parsing in different stages.
+        f = open(filename, 'r')
+        lines = f.readlines()
+        f.close()
+        self._parse_lines(lines, debug=debug)
+
+    def _parse_lines(self, lines, debug=False):
         # This is a simple state machine based
         # parser to read our data file format.
         # There are definatly better ways to do this
@@ -55,8 +86,7 @@ class Volcano:
         multiline = False
         multiline_keyword = None
 
-        f = open(filename, 'r')
-        for line in f:
+        for line in lines:
 
             new_section = re.match(r"\s*\[\s*Start\s+(\w+)\s*\]",line)
             if new_section:
@@ -81,9 +111,14 @@ class Volcano:
                 else:
                     raise Exception("End section did not match start")
 
-            key_val = re.match(r"\s*(\w+)\s*:(.+?)$", line)
+            key_val = re.match(r"\s*(\w+(?:[ \t]+\w+)?)\s*:(.+?)$", line)
+            if key_val:
+                keyword = re.sub(r"\s+", " ", key_val.group(1)).upper()
+                if (" " in keyword) and (keyword not in _multiword_keywords):
+                    # Just text with a colon in it, e.g. inside
+                    # a multiline description.
+                    key_val = None
             if key_val:
-                keyword = key_val.group(1).strip().upper()
                 value = key_val.group(2).strip()
                 if (value==">>"):
                     if multiline:
@@ -120,6 +155,39 @@ class Volcano:
                         elif keyword=="ROCKTYPE":
                             self.rocktype = value
                             continue
+                        elif keyword=="TYPEV" or keyword=="VOLCANO TYPE":
+                            self.typev = value
+                            continue
+                        elif keyword=="REGION":
+                            self.region = value
+                            continue
+                        elif keyword=="COUNTRY":
+                            self.country = value
+                            continue
+                        elif keyword=="ELEVATION":
+                            self.elevation = self._measurement(keyword, value, _length_units, "m")
+                            continue
+                        elif keyword=="MAGNITUDE":
+                            self.magnitude = self._measurement(keyword, value, _rate_units, "cm/yr")
+                            continue
+                        elif keyword=="DURATION":
+                            self.duration = self._measurement(keyword, value, _time_units, "years")
+                            continue
+                        elif keyword=="OBS FREQ":
+                            self.obs_freq = self._measurement(keyword, value, _time_units, "years")
+                            continue
+                        elif keyword=="METHOD":
+                            self.method = value
+                            continue
+                        elif keyword=="VOLCIMAGE":
+                            self.volcimage = value
+                            continue
+                        elif keyword=="RAWIMAGE":
+                            self.rawimage = value
+                            continue
+                        elif keyword=="INTERPIMAGE":
+                            self.interpimage = value
+                            continue
                         elif keyword=="DESCRIPTION":
                             self.description = self.description+value
                             continue
@@ -136,15 +204,13 @@ class Volcano:
                             else:
                                 raise Exception("Double study type")
                         elif keyword=="DESCRIPTION":
-                            self.studies[-1].description = self.description+value
+                            self.studies[-1].description = self.studies[-1].description+value
                             continue
                         elif keyword=="STARTDATE":
-                            (d, m, y) = value.split('/',3)
-                            self.studies[-1].startdate = datetime.date(int(y), int(m), int(d))
+                            self.studies[-1].startdate = _parse_date(value)
                             continue
                         elif keyword=="ENDDATE":
-                            (d, m, y) = value.split('/',3)
-                            self.studies[-1].enddate = datetime.date(int(y), int(m), int(d))
+                            self.studies[-1].enddate = _parse_date(value)
                             continue
                         elif keyword=="REFERENCE":
                             self.studies[-1].references.append(value)
@@ -152,23 +218,21 @@ class Volcano:
                  
                     elif section_name == "EVENT":
                         if keyword=="TYPE":
-                            if self.event[-1].type is None:
-                                self.event[-1].type = vaue
+                            if self.events[-1].type is None:
+                                self.events[-1].type = value
                             else:
-                                raise Exception("Double study type")
+                                raise Exception("Double event type")
                         elif keyword=="DESCRIPTION":
-                            self.event[-1].description = self.description+value
+                            self.events[-1].description = self.events[-1].description+value
                             continue
                         elif keyword=="STARTDATE":
-                            (d, m, y) = value.split('/',3)
-                            self.event[-1].startdate = datetime.date(int(y), int(m), int(d))
+                            self.events[-1].startdate = _parse_date(value)
                             continue
                         elif keyword=="ENDDATE":
-                            (d, m, y) = value.split('/',3)
-                            self.event[-1].enddate = datetime.date(int(y), int(m), int(d))
+                            self.events[-1].enddate = _parse_date(value)
                             continue
                         elif keyword=="REFERENCE":
-                            self.event[-1].references.append(value)
+                            self.events[-1].references.append(value)
                             continue
                  
                     else:
@@ -181,19 +245,65 @@ class Volcano:
                             self.description = self.description+line.strip()+" "
                     elif section_name == "STUDY":
                         if multiline_keyword == "DESCRIPTION":
-                            self.studies[-1].description = self.description+line.strip()+" "
+                            self.studies[-1].description = self.studies[-1].description+line.strip()+" "
                     elif section_name == "EVENT":
                         if multiline_keyword == "DESCRIPTION":
-                            self.event[-1].description = self.description+line.strip()+" "
+                            self.events[-1].description = self.events[-1].description+line.strip()+" "
 
                 # Should we error out here? 
 
+    def _measurement(self, keyword, value, units, norm_unit):
+        # A value we cannot read is no reason to lose the
+        # rest of the file, so note it and carry on.
+        try:
+            return _parse_measurement(value, units, norm_unit)
+        except Exception, e:
+            self.warnings.append(keyword + ": " + str(e))
+            return None
+
+    def record_fields(self):
+        """ A hash of each field, to see which fields have changed """
+        return _record_fields(self, self.record_field_names)
+
+    def record_hash(self):
+        """ A hash of the whole record, including studies and events
+
+        This only changes if the data changes: whitespace in
+        text and the order of references, studies and events
+        in the data file make no difference.
+        """
+        return _sha1(_canonical(self.record_fields()))
+
     def dump(self):
         print "ID: " + self.id
         print "Name: " + self.name
         print "Latitude: " + str(self.latitude)
         print "Longitude: " + str(self.longitude)
         print "Rocktype: " + self.rocktype
+        if self.typev is not None:
+            print "Typev: " + self.typev
+        if self.region is not None:
+            print "Region: " + self.region
+        if self.country is not None:
+            print "Country: " + self.country
+        if self.elevation is not None:
+            print "Elevation: " + str(self.elevation)
+        if self.magnitude is not None:
+            print "Magnitude: " + str(self.magnitude)
+        if self.duration is not None:
+            print "Duration: " + str(self.duration)
+        if self.obs_freq is not None:
+            print "Obs freq: " + str(self.obs_freq)
+        if self.method is not None:
+            print "Method: " + self.method
+        for warning in self.warnings:
+            print "Warning: " + warning
+        if self.volcimage is not None:
+            print "Volcimage: " + self.volcimage
+        if self.rawimage is not None:
+            print "Rawimage: " + self.rawimage
+        if self.interpimage is not None:
+            print "Interpimage: " + self.interpimage
         if self.description != "":
             print "Description: " + self.description
 
@@ -204,7 +314,7 @@ class Volcano:
                 print "Description: " + event.description
             if event.startdate is not None:
                 print "Startdate: " + event.startdate.strftime('%d/%m/%Y')
-            if study.enddate is not None:
+            if event.enddate is not None:
                 print "Enddate: " + event.enddate.strftime('%d/%m/%Y')
             for reference in event.references:
                 print "Reference: " + reference
@@ -226,7 +336,13 @@ class Volcano:
         for reference in self.references:
             print "Reference: " + reference
 
-    def html(self):
+    def html(self, images=None):
+        # images can map the image paths given in the
+        # data file to (src, width, height) for the
+        # page, e.g. from volc_assets.AssetStore. A URL
+        # is linked to as it is; any other image is left
+        # out, as its path is relative to the data file
+        # and would not be found from the page.
         head = """<html><head>
         <title>{name}</title>
         </head>
@@ -279,13 +395,166 @@ class Volcano:
                                  start=str(event.startdate), 
                                  end=str(event.enddate), 
                                  desc=event.description)
-            eventss = eventss+"<h4>References</h4><ul>"
+            events = events+"<h4>References</h4><ul>"
             for reference in event.references:
                 events = events + "<li>{ref}</li>".format(ref=reference)
             events = events+"</ul>"
 
+        pictures = ""
+        for (path, alt) in [(self.volcimage, self.name),
+                            (self.rawimage, "Interferogram"),
+                            (self.interpimage, "Interpreted interferogram")]:
+            if (images is not None) and (path in images):
+                (src, width, height) = images[path]
+            elif (path is not None) and ("://" in path):
+                (src, width, height) = (path, None, None)
+            else:
+                continue
+            if width is not None:
+                pictures = pictures+"""<img src="{src}" width="{width}" height="{height}"
+                                 alt="{alt}" loading="lazy">""".format(src=src,
+                                 width=width, height=height, alt=alt)
+            else:
+                pictures = pictures+"""<img src="{src}" alt="{alt}"
+                                 loading="lazy">""".format(src=src, alt=alt)
+        if pictures != "":
+            pictures = "<h2>Images</h2>"+pictures
+
         tail = "</body></html>"
-        return head+events+studies+volc_refs+tail
+        return head+pictures+events+studies+volc_refs+tail
+
+# Keywords that contain a space. Anything else with a
+# space before the colon is treated as ordinary text.
+_multiword_keywords = ["OBS FREQ", "VOLCANO TYPE"]
+
+# Units we understand for each kind of measurement and the
+# factor that converts them to the normalised unit.
+_length_units = {"m": 1.0, "km": 1000.0, "ft": 0.3048}
+_rate_units = {"mm/yr": 0.1, "cm/yr": 1.0, "m/yr": 100.0,
+               "mm/year": 0.1, "cm/year": 1.0, "m/year": 100.0,
+               "mm/a": 0.1, "cm/a": 1.0, "m/a": 100.0}
+_time_units = {"day": 1.0/365.25, "days": 1.0/365.25,
+               "week": 7.0/365.25, "weeks": 7.0/365.25,
+               "month": 1.0/12.0, "months": 1.0/12.0,
+               "yr": 1.0, "yrs": 1.0, "year": 1.0, "years": 1.0}
+
+_number = r"[-+]?\d[\d,]*(?:\.\d*)?|[-+]?\.\d+"
+_measurement_re = re.compile(r"^(<=|>=|<|>|~|c\.|ca\.)?\s*(" + _number +
+                             r")(?:\s*(?:-|to)\s*(" + _number + r"))?\s*(.*?)$")
+
+def _parse_measurement(value, units, norm_unit):
+    # Turn strings like "-1.5 cm/yr", "< 3 years",
+    # "2,356m" or "2-5 km" into a Measurement in
+    # norm_unit, which is also assumed if the data
+    # file does not give a unit.
+    match = _measurement_re.match(value.strip())
+    if not match:
+        raise Exception("Cannot read a number from '" + value + "'")
+    (qualifier, first, second, unit) = match.groups()
+    unit = re.sub(r"\s*/\s*", "/", unit.strip().lower())
+    if unit == "":
+        unit = norm_unit
+    if unit not in units:
+        raise Exception("Unknown unit '" + unit + "' in '" + value + "'")
+    factor = units[unit]
+    first = float(first.replace(',', '')) * factor
+    measurement = Measurement(norm_unit)
+    if second is not None:
+        second = float(second.replace(',', '')) * factor
+        measurement.low = min(first, second)
+        measurement.high = max(first, second)
+        measurement.value = (first + second) / 2.0
+        measurement.qualifier = "range"
+        return measurement
+    measurement.value = first
+    if qualifier in ["<", "<="]:
+        measurement.high = first
+        measurement.qualifier = qualifier
+    elif qualifier in [">", ">="]:
+        measurement.low = first
+        measurement.qualifier = qualifier
+    elif qualifier is not None:
+        measurement.low = first
+        measurement.high = first
+        measurement.qualifier = "~"
+    else:
+        measurement.low = first
+        measurement.high = first
+    return measurement
+
+def study_terms(study_type):
+    """ The sensors or methods in a study type, e.g. ERS1/ERS2, InSAR """
+    terms = set()
+    for term in re.split(r"\s*(?:,|/|\band\b)\s*", study_type):
+        term = term.strip()
+        if term != "":
+            terms.add(term)
+    return terms
+
+def _sha1(text):
+    if isinstance(text, unicode):
+        text = text.encode('utf-8')
+    return hashlib.sha1(text).hexdigest()
+
+def _canonical(value):
+    # A string standing for a field value, for hashing.
+    # Whitespace is collapsed and lists are sorted so
+    # that tidying up a data file does not change it.
+    if value is None:
+        return ""
+    elif isinstance(value, dict):
+        return "\n".join([key+"="+value[key] for key in sorted(value)])
+    elif isinstance(value, list):
+        return "\n".join(sorted([_canonical(item) for item in value]))
+    elif isinstance(value, float):
+        return repr(value)
+    elif isinstance(value, datetime.date):
+        return value.isoformat()
+    elif isinstance(value, Measurement):
+        return "{0!r} {1!r} {2!r} {3} {4}".format(value.value, value.low,
+                   value.high, value.qualifier, value.unit)
+    elif isinstance(value, Study) or isinstance(value, Event):
+        return value.record_hash()
+    else:
+        return " ".join(value.split())
+
+def _record_fields(record, names):
+    fields = {}
+    for name in names:
+        fields[name] = _sha1(_canonical(getattr(record, name)))
+    return fields
+
+def _parse_date(value):
+    # Dates are normally dd/mm/yyyy but some of the
+    # data files only give a year. These are taken
+    # to mean the first of January of that year.
+    if '/' in value:
+        (d, m, y) = value.split('/',3)
+        return datetime.date(int(y), int(m), int(d))
+    else:
+        return datetime.date(int(value), 1, 1)
+
+class Measurement:
+    "A number from a data file in normalised units, with its bounds"
+
+    def __init__(self, unit):
+        self.unit = unit
+        self.value = float('NaN')
+        # The true value lies between low and high, which
+        # are infinite for one sided values like "< 3 years"
+        self.low = float('-inf')
+        self.high = float('inf')
+        # One of None (exact), "<", "<=", ">", ">=",
+        # "~" (approximate) or "range"
+        self.qualifier = None
+
+    def __str__(self):
+        if self.qualifier == "range":
+            return "{0:g}-{1:g} {2}".format(self.low, self.high, self.unit)
+        elif self.qualifier is not None:
+            return "{0} {1:g} {2}".format(self.qualifier, self.value, self.unit)
+        else:
+            return "{0:g} {1}".format(self.value, self.unit)
 
 class Event:
     "Something that happened to a volcano"
@@ -298,6 +567,15 @@ class Event:
         self.enddate = None
         self.references = []
 
+    record_field_names = ["type", "description", "startdate",
+                          "enddate", "references"]
+
+    def record_fields(self):
+        return _record_fields(self, self.record_field_names)
+
+    def record_hash(self):
+        return _sha1(_canonical(self.record_fields()))
+
 class Study:
     "An observation of volcanic deformation"
 
@@ -308,16 +586,33 @@ class Study:
         self.startdate = None
         self.enddate = None
         self.references = []
+
+    record_field_names = ["type", "description", "startdate",
+                          "enddate", "references"]
+
+    def record_fields(self):
+        return _record_fields(self, self.record_field_names)
+
+    def record_hash(self):
+        return _sha1(_canonical(self.record_fields()))
             
 if __name__=="__main__":
     import sys
     mode = sys.argv[1]
+    if mode == "stats":
+        from volc_stats import VolcanoStats
+        stats = VolcanoStats()
     for file in sys.argv[2:]:
         volcano = Volcano(filename=file)
         if mode == "dump":
             volcano.dump()
         if mode == "html":
             print volcano.html()
+        if mode == "stats" and volcano.id is not None:
+            # Files without an ID, e.g. a README, are not volcanoes
+            stats.add(volcano, filename=file)
+    if mode == "stats":
+        print stats.to_json()
               
 
     
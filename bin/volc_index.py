@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+""" volc_index: find volcanoes by their attributes
+
+An AttributeIndex maps each value of the rock type, volcano type,
+region, country and study type to the set of IDs of the volcanoes
+that have it. Filters combining these with AND, OR and NOT are
+then answered with set operations rather than by looking at every
+volcano, and an AND intersects the smallest set first so the work
+done is set by the rarest value. Values must match exactly,
+except that a study type naming several sensors or methods,
+such as "ERS1/ERS2, Envisat and InSAR", is split at each comma,
+slash and "and" and indexed under each of them, so that
+study_type=InSAR finds it.
+
+A filter is a nested tuple, e.g. Phonolite volcanoes in Kenya
+studied with ALOS or GPS, but not shields:
+
+    ("and", ("rocktype", "Phonolite"), ("country", "Kenya"),
+            ("or", ("study_type", "ALOS"), ("study_type", "GPS")),
+            ("not", ("typev", "Shield")))
+
+A volcano can be added again after it changes, or removed, and
+only its own entries in the index are touched.
+
+When used as a script, attr=value conditions (attr!=value to
+exclude, attr=a|b for either) are combined with AND and the
+matching IDs are printed, e.g.:
+
+    volc_index.py country=Kenya study_type="ALOS|GPS" ../data/2*
+"""
+
+import re
+
+from volc_def import Volcano, study_terms
+
+class AttributeIndex:
+    """ Sets of volcano IDs for each value of each attribute """
+
+    attributes = ["rocktype", "typev", "region", "country", "study_type"]
+
+    def __init__(self, volcanoes=None):
+        # postings[attribute][value] is the set of IDs and
+        # indexed[id] what we put in for that volcano, so
+        # that it can be taken out again.
+        self.postings = {}
+        for attribute in self.attributes:
+            self.postings[attribute] = {}
+        self.indexed = {}
+        if volcanoes is not None:
+            for volcano in volcanoes:
+                self.add(volcano)
+
+    def __len__(self):
+        return len(self.indexed)
+
+    def _values(self, volcano):
+        values = {}
+        for attribute in ["rocktype", "typev", "region", "country"]:
+            value = getattr(volcano, attribute)
+            if value is None:
+                values[attribute] = set()
+            else:
+                values[attribute] = set([value])
+        values["study_type"] = set()
+        for study in volcano.studies:
+            if study.type is not None:
+                values["study_type"].update(study_terms(study.type))
+        return values
+
+    def add(self, volcano):
+        """ Index a volcano, replacing any earlier version of it """
+        if volcano.id is None:
+            raise Exception("Cannot index a volcano without an ID")
+        if volcano.id in self.indexed:
+            self.remove(volcano.id)
+        values = self._values(volcano)
+        for attribute in self.attributes:
+            postings = self.postings[attribute]
+            for value in values[attribute]:
+                postings.setdefault(value, set()).add(volcano.id)
+        self.indexed[volcano.id] = values
+
+    def remove(self, volc_id):
+        """ Take a volcano (given by ID) out of the index """
+        if volc_id not in self.indexed:
+            raise Exception("Volcano " + volc_id + " is not indexed")
+        values = self.indexed.pop(volc_id)
+        for attribute in self.attributes:
+            postings = self.postings[attribute]
+            for value in values[attribute]:
+                postings[value].discard(volc_id)
+                if len(postings[value]) == 0:
+                    del postings[value]
+
+    def lookup(self, attribute, value):
+        """ IDs of the volcanoes with this value (do not modify) """
+        if attribute not in self.postings:
+            raise Exception("No index on " + attribute)
+        return self.postings[attribute].get(value, frozenset())
+
+    def values(self, attribute):
+        """ Each value of an attribute and how many volcanoes have it """
+        counts = {}
+        for (value, ids) in self.postings[attribute].items():
+            counts[value] = len(ids)
+        return counts
+
+    def query(self, expression):
+        """ The set of IDs matching a filter expression """
+        return set(self._evaluate(expression))
+
+    def _evaluate(self, expression):
+        # May return a posting set itself, so callers
+        # must not change what comes back.
+        op = expression[0]
+        if op == "and":
+            return self._and(expression[1:])
+        elif op == "or":
+            result = set()
+            for term in expression[1:]:
+                result.update(self._evaluate(term))
+            return result
+        elif op == "not":
+            return set(self.indexed).difference(self._evaluate(expression[1]))
+        else:
+            (attribute, value) = expression
+            return self.lookup(attribute, value)
+
+    def _and(self, terms):
+        # Work out the positive terms, then intersect them
+        # smallest first and stop as soon as nothing is left.
+        # NOT terms are subtracted from what remains rather
+        # than being turned into a set of everything else.
+        included = []
+        excluded = []
+        for term in terms:
+            if term[0] == "not":
+                excluded.append(term[1])
+            else:
+                included.append(self._evaluate(term))
+        if len(included) == 0:
+            result = set(self.indexed)
+        else:
+            included.sort(key=len)
+            result = set(included[0])
+            for ids in included[1:]:
+                if len(result) == 0:
+                    break
+                result.intersection_update(ids)
+        for term in excluded:
+            if len(result) == 0:
+                break
+            result.difference_update(self._evaluate(term))
+        return result
+
+_condition_re = re.compile(r"^(\w+)(!?=)(.*)$")
+
+def parse_condition(text):
+    """ Turn 'country=Kenya' into a filter expression, or None """
+    match = _condition_re.match(text)
+    if (not match) or (match.group(1) not in AttributeIndex.attributes):
+        return None
+    (attribute, op, values) = match.groups()
+    terms = [(attribute, value) for value in values.split("|")]
+    if len(terms) == 1:
+        expression = terms[0]
+    else:
+        expression = tuple(["or"] + terms)
+    if op == "!=":
+        expression = ("not", expression)
+    return expression
+
+if __name__=="__main__":
+    import sys
+    conditions = []
+    index = AttributeIndex()
+    for arg in sys.argv[1:]:
+        condition = parse_condition(arg)
+        if condition is not None:
+            conditions.append(condition)
+        else:
+            index.add(Volcano(filename=arg))
+    for volc_id in sorted(index.query(tuple(["and"] + conditions))):
+        print volc_id
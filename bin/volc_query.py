@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+""" volc_query: numeric queries over many volcanoes
+
+The numeric fields of each volcano (position, elevation and
+the deformation magnitude, duration and observation frequency)
+are copied once into columns held in arrays of doubles. Queries
+like "subsiding faster than 1 cm/yr, above 2000 m" are then
+answered by comparing whole columns against a number rather
+than by looking inside every Volcano (or its strings) again.
+
+Missing values are stored as NaN, and a volcano with no
+magnitude is never returned by a query on magnitude, not even
+by magnitude!=0. Each measurement also has _low and _high columns
+holding its bounds, so "< 3 years" can be queried safely.
+
+When used as a script, conditions and data files can be given
+in any order, e.g.:
+
+    volc_query.py "magnitude<-1" "elevation>2000" ../data/*
+"""
+
+import re
+import operator
+import itertools
+from array import array
+
+from volc_def import Volcano
+
+_operators = {"<": operator.lt, "<=": operator.le,
+              ">": operator.gt, ">=": operator.ge,
+              "==": operator.eq, "!=": operator.ne}
+
+_condition_re = re.compile(r"^\s*(\w+)\s*(<=|>=|==|!=|<|>)\s*(\S+)\s*$")
+
+class DeformationTable:
+    """ Column store of the numeric fields of many volcanoes """
+
+    # Plain floats on the Volcano
+    float_fields = ["latitude", "longitude"]
+    # Measurements, which give three columns each
+    measurement_fields = ["elevation", "magnitude", "duration", "obs_freq"]
+
+    def __init__(self, volcanoes=None):
+        self.ids = []
+        self.columns = {}
+        for field in self.float_fields:
+            self.columns[field] = array('d')
+        for field in self.measurement_fields:
+            self.columns[field] = array('d')
+            self.columns[field+"_low"] = array('d')
+            self.columns[field+"_high"] = array('d')
+        if volcanoes is not None:
+            for volcano in volcanoes:
+                self.append(volcano)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def append(self, volcano):
+        """ Add one volcano as a new row """
+        self.ids.append(volcano.id)
+        for field in self.float_fields:
+            self.columns[field].append(getattr(volcano, field))
+        for field in self.measurement_fields:
+            measurement = getattr(volcano, field)
+            if measurement is None:
+                self.columns[field].append(float('NaN'))
+                self.columns[field+"_low"].append(float('NaN'))
+                self.columns[field+"_high"].append(float('NaN'))
+            else:
+                self.columns[field].append(measurement.value)
+                self.columns[field+"_low"].append(measurement.low)
+                self.columns[field+"_high"].append(measurement.high)
+
+    def mask(self, column, op, value):
+        """ True/False for each row where 'column op value' holds """
+        if column not in self.columns:
+            raise Exception("No column called " + column)
+        if op not in _operators:
+            raise Exception("Unknown comparison " + op)
+        values = self.columns[column]
+        mask = map(_operators[op], values,
+                   itertools.repeat(float(value), len(self.ids)))
+        if op == "!=":
+            # NaN compares true with != (and only with !=),
+            # so rule out missing values, where v != v.
+            mask = map(operator.and_, mask, map(operator.eq, values, values))
+        return mask
+
+    def select(self, *conditions):
+        """ IDs of the volcanoes where every (column, op, value) holds """
+        keep = [True] * len(self.ids)
+        for (column, op, value) in conditions:
+            keep = map(operator.and_, keep, self.mask(column, op, value))
+        return list(itertools.compress(self.ids, keep))
+
+def parse_condition(text):
+    """ Turn 'magnitude<-1' into ('magnitude', '<', -1.0), or None """
+    match = _condition_re.match(text)
+    if not match:
+        return None
+    try:
+        value = float(match.group(3))
+    except ValueError:
+        return None
+    return (match.group(1), match.group(2), value)
+
+if __name__=="__main__":
+    import sys
+    conditions = []
+    table = DeformationTable()
+    for arg in sys.argv[1:]:
+        condition = parse_condition(arg)
+        if condition is not None:
+            conditions.append(condition)
+        else:
+            table.append(Volcano(filename=arg))
+    for volc_id in table.select(*conditions):
+        print volc_id
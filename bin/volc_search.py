@@ -0,0 +1,270 @@
+#!/usr/bin/env python
+""" volc_search: find volcanoes by name, allowing for misspellings
+
+A NameIndex holds two things. The first is a sorted list of keys
+(each volcano's whole name, each word of it and its ID, reduced
+to lower case ASCII) found by binary search, so everything
+starting with what has been typed so far is found without
+looking at every name. The second maps each trigram (run of
+three characters) of each name to the volcanoes that contain it,
+so that a misspelt name can still be matched by the share of its
+trigrams it has in common with the real one.
+
+The same index is exported for the search box on the website as
+small JSON files, so the browser only fetches the part it needs:
+
+    index.json          the shards and the rules for picking them
+    prefix/<p>.json     sorted [key, ID, name] for keys starting p
+    trigram/<c>.json    trigram -> [[ID, name, number of trigrams
+                        in the name], ...] for trigrams whose first
+                        character other than a space is c
+
+Prefix shards start out one per first character; any holding
+more than shard_size keys (e.g. all the IDs starting 2) is split
+again on the next character, and so on. index.json maps each
+shard prefix to its file (a space in a prefix is written as _).
+For what has been typed, the search box fetches every shard whose
+prefix starts with it or, if there is none, the one with the
+longest prefix that it starts with. Each entry carries the name
+to show and what is needed to score it, so no list of every
+name is ever sent. Shards left over from
+an earlier export are removed, and every file is written to a
+temporary file and renamed so the site never sees half of one.
+
+When used as a script, e.g.:
+
+    volc_search.py sus ../data/*
+    volc_search.py --export ../www/search ../data/*
+"""
+
+import os
+import re
+import json
+import bisect
+import threading
+import unicodedata
+
+from volc_def import Volcano
+
+def normalise(text):
+    """ Lower case ASCII letters and digits separated by single spaces """
+    if not isinstance(text, unicode):
+        text = text.decode('utf-8', 'replace')
+    text = unicodedata.normalize('NFKD', text)
+    text = text.encode('ascii', 'ignore').lower()
+    return " ".join(re.split(r"[^a-z0-9]+", text)).strip()
+
+def trigrams(text):
+    """ The set of trigrams of a normalised name """
+    # Pad each word so that the start and end of words
+    # count for more, as they are less often misspelt.
+    grams = set()
+    for word in text.split():
+        padded = "  " + word + " "
+        for i in range(len(padded) - 2):
+            grams.add(padded[i:i+3])
+    return grams
+
+def _split_shards(entries, prefix, shard_size, shards):
+    # Put sorted [key, ...] entries that start with prefix
+    # into shards, splitting on the next character of the
+    # key while there are more than shard_size of them.
+    if len(entries) <= shard_size:
+        shards[prefix] = entries
+        return
+    exact = []
+    groups = {}
+    for entry in entries:
+        key = entry[0]
+        if len(key) <= len(prefix):
+            # Can go no further, e.g. a very common word
+            exact.append(entry)
+        else:
+            groups.setdefault(key[:len(prefix)+1], []).append(entry)
+    if len(exact) > 0:
+        shards[prefix] = exact
+    for (longer, group) in groups.items():
+        _split_shards(group, longer, shard_size, shards)
+
+class NameIndex:
+    """ Prefix and trigram lookup of volcano names """
+
+    def __init__(self, volcanoes=None):
+        self.names = {}
+        self.keys = [] # sorted (key, id) pairs
+        self.grams = {} # trigram -> set of IDs
+        self.counts = {} # id -> number of trigrams
+        self.lock = threading.Lock()
+        if volcanoes is not None:
+            for volcano in volcanoes:
+                self.add(volcano)
+
+    def __len__(self):
+        return len(self.names)
+
+    def _keys(self, volc_id, name):
+        keys = set([normalise(volc_id)])
+        if name is not None:
+            key = normalise(name)
+            keys.add(key)
+            keys.update(key.split())
+        keys.discard("")
+        return keys
+
+    def add(self, volcano):
+        """ Index a volcano's name and ID, replacing any earlier entry """
+        if volcano.id is None:
+            raise Exception("Cannot index a volcano without an ID")
+        with self.lock:
+            if volcano.id in self.names:
+                self._remove(volcano.id)
+            self.names[volcano.id] = volcano.name
+            for key in self._keys(volcano.id, volcano.name):
+                bisect.insort(self.keys, (key, volcano.id))
+            grams = set()
+            if volcano.name is not None:
+                grams = trigrams(normalise(volcano.name))
+            for gram in grams:
+                self.grams.setdefault(gram, set()).add(volcano.id)
+            self.counts[volcano.id] = len(grams)
+
+    def remove(self, volc_id):
+        """ Take a volcano (given by ID) out of the index """
+        with self.lock:
+            self._remove(volc_id)
+
+    def _remove(self, volc_id):
+        if volc_id not in self.names:
+            raise Exception("Volcano " + volc_id + " is not indexed")
+        name = self.names.pop(volc_id)
+        for key in self._keys(volc_id, name):
+            i = bisect.bisect_left(self.keys, (key, volc_id))
+            del self.keys[i]
+        if name is not None:
+            for gram in trigrams(normalise(name)):
+                self.grams[gram].discard(volc_id)
+                if len(self.grams[gram]) == 0:
+                    del self.grams[gram]
+        del self.counts[volc_id]
+
+    def prefix(self, text, limit=10):
+        """ IDs of volcanoes with a name, word of a name or ID starting text """
+        text = normalise(text)
+        found = []
+        if text == "":
+            return found
+        with self.lock:
+            i = bisect.bisect_left(self.keys, (text,))
+            while (i < len(self.keys)) and (len(found) < limit):
+                (key, volc_id) = self.keys[i]
+                if not key.startswith(text):
+                    break
+                if volc_id not in found:
+                    found.append(volc_id)
+                i = i + 1
+        return found
+
+    def fuzzy(self, text, limit=10, threshold=0.3):
+        """ IDs of volcanoes whose names share most trigrams with text
+
+        The score is the number of shared trigrams over the number
+        in either; names scoring below threshold are left out.
+        """
+        query = trigrams(normalise(text))
+        if len(query) == 0:
+            return []
+        shared = {}
+        with self.lock:
+            for gram in query:
+                for volc_id in self.grams.get(gram, ()):
+                    shared[volc_id] = shared.get(volc_id, 0) + 1
+            scored = []
+            for (volc_id, count) in shared.items():
+                score = float(count) / (len(query) + self.counts[volc_id] - count)
+                if score >= threshold:
+                    scored.append((-score, volc_id))
+        scored.sort()
+        return [volc_id for (score, volc_id) in scored[:limit]]
+
+    def search(self, text, limit=10):
+        """ Prefix matches first, then fuzzy matches to fill up to limit """
+        found = self.prefix(text, limit=limit)
+        if len(found) < limit:
+            for volc_id in self.fuzzy(text, limit=limit):
+                if (volc_id not in found) and (len(found) < limit):
+                    found.append(volc_id)
+        return found
+
+    def export(self, outdir, shard_size=200):
+        """ Write the index as sharded JSON for the website """
+        with self.lock:
+            by_char = {}
+            for (key, volc_id) in self.keys:
+                by_char.setdefault(key[0], []).append(
+                    [key, volc_id, self.names[volc_id]])
+            grams = {}
+            for (gram, ids) in self.grams.items():
+                # Not by gram[0], which is a space for the
+                # padded start of every word.
+                shard = grams.setdefault(gram.lstrip()[0], {})
+                shard[gram] = [[volc_id, self.names[volc_id],
+                                self.counts[volc_id]]
+                               for volc_id in sorted(ids)]
+        prefix = {}
+        for (char, entries) in by_char.items():
+            _split_shards(entries, char, shard_size, prefix)
+        prefix_files = {}
+        for shard in prefix:
+            prefix_files[shard] = shard.replace(" ", "_") + ".json"
+        trigram_files = {}
+        for shard in grams:
+            trigram_files[shard] = shard + ".json"
+        for (dirname, shards, files) in [("prefix", prefix, prefix_files),
+                                         ("trigram", grams, trigram_files)]:
+            shard_dir = os.path.join(outdir, dirname)
+            if not os.path.isdir(shard_dir):
+                os.makedirs(shard_dir)
+            for (shard, entries) in shards.items():
+                _write_json(os.path.join(shard_dir, files[shard]), entries)
+            # Only once the new shards are in place, remove
+            # those left over from an earlier export.
+            wanted = set(files.values())
+            for filename in os.listdir(shard_dir):
+                if filename not in wanted:
+                    os.remove(os.path.join(shard_dir, filename))
+        _write_json(os.path.join(outdir, "index.json"),
+                    {"prefix": prefix_files, "trigram": trigram_files,
+                     "trigram_shard": "first character that is not a space",
+                     "pad": ["  ", " "]})
+        # Earlier exports wrote every name to one file
+        old_names = os.path.join(outdir, "names.json")
+        if os.path.exists(old_names):
+            os.remove(old_names)
+
+def _write_json(filename, data):
+    # Compact, as these are fetched by the browser
+    tmpname = filename + ".tmp"
+    f = open(tmpname, 'w')
+    json.dump(data, f, sort_keys=True, separators=(',', ':'))
+    f.close()
+    os.rename(tmpname, filename)
+
+if __name__=="__main__":
+    import sys
+    args = sys.argv[1:]
+    if args[0] == "--export":
+        outdir = args[1]
+        files = args[2:]
+    else:
+        query = args[0]
+        files = args[1:]
+    index = NameIndex()
+    for file in files:
+        volcano = Volcano(filename=file)
+        if volcano.id is not None:
+            index.add(volcano)
+    if args[0] == "--export":
+        index.export(outdir)
+    else:
+        for volc_id in index.search(query):
+            print volc_id, index.names[volc_id]
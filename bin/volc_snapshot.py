@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+""" volc_snapshot: which volcanoes changed between two versions
+
+A snapshot records, for every volcano in a version of the data,
+the hash of its record (Volcano.record_hash()) and of each of its
+fields. Comparing two snapshots tells the mirror, the exports and
+the search index exactly which volcanoes were added, removed or
+changed, without looking at the data files again. Because the
+hashes ignore whitespace and the order of references, studies
+and events, tidying up a data file does not count as a change.
+
+When used as a script, e.g.:
+
+    volc_snapshot.py snapshot old.json ../data/*
+    volc_snapshot.py snapshot new.json ../data/*
+    volc_snapshot.py diff old.json new.json
+    volc_snapshot.py diff --fields old.json new.json
+
+the diff prints one line per volcano, such as "changed 222110",
+followed by the names of the changed fields if asked for.
+"""
+
+import json
+
+from volc_def import Volcano
+
+def snapshot(volcanoes):
+    """ Map each volcano ID to its record hash and field hashes """
+    snap = {}
+    for volcano in volcanoes:
+        if volcano.id is None:
+            raise Exception("Cannot snapshot a volcano without an ID")
+        if volcano.id in snap:
+            raise Exception("Volcano " + volcano.id + " appears twice")
+        snap[volcano.id] = {"hash": volcano.record_hash(),
+                            "fields": volcano.record_fields()}
+    return snap
+
+def save(snap, filename):
+    f = open(filename, 'w')
+    json.dump(snap, f, sort_keys=True, indent=2)
+    f.close()
+
+def load(filename):
+    f = open(filename, 'r')
+    snap = json.load(f)
+    f.close()
+    return snap
+
+def diff(old, new, fields=False):
+    """ Compare two snapshots, returns (added, removed, changed)
+
+    added and removed are sorted lists of IDs. changed is a
+    sorted list of IDs, or if fields is True a dictionary from
+    each changed ID to a sorted list of its changed fields.
+    """
+    added = []
+    changed = {}
+    for (volc_id, record) in new.items():
+        old_record = old.get(volc_id)
+        if old_record is None:
+            added.append(volc_id)
+        elif old_record["hash"] != record["hash"]:
+            changed_fields = []
+            if fields:
+                for (name, value) in record["fields"].items():
+                    if old_record["fields"].get(name) != value:
+                        changed_fields.append(name)
+                for name in old_record["fields"]:
+                    if name not in record["fields"]:
+                        changed_fields.append(name)
+            changed[volc_id] = sorted(changed_fields)
+    removed = [volc_id for volc_id in old if volc_id not in new]
+    if fields:
+        return (sorted(added), sorted(removed), changed)
+    else:
+        return (sorted(added), sorted(removed), sorted(changed))
+
+if __name__=="__main__":
+    import sys
+    mode = sys.argv[1]
+    if mode == "snapshot":
+        volcanoes = []
+        for file in sys.argv[3:]:
+            volcano = Volcano(filename=file)
+            # Not a volcano, e.g. a README
+            if volcano.id is not None:
+                volcanoes.append(volcano)
+        save(snapshot(volcanoes), sys.argv[2])
+    if mode == "diff":
+        fields = "--fields" in sys.argv
+        (old_file, new_file) = [arg for arg in sys.argv[2:]
+                                if arg != "--fields"]
+        (added, removed, changed) = diff(load(old_file), load(new_file),
+                                         fields=fields)
+        for volc_id in added:
+            print "added", volc_id
+        for volc_id in removed:
+            print "removed", volc_id
+        for volc_id in sorted(changed):
+            if fields:
+                print "changed", volc_id, " ".join(changed[volc_id])
+            else:
+                print "changed", volc_id
@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+""" volc_stats: aggregate statistics for the deformation database
+
+This module keeps running totals (counts by region, country,
+rock type, volcano type, study type and studies per year) for a
+collection of volcanoes. The contribution made by each volcano
+is remembered by its ID so that when a data file is added,
+changed or removed only that volcano needs to be parsed again;
+the totals are never rebuilt from the whole database.
+
+When used as a script the totals are held in a JSON store
+file which is updated in place, e.g.:
+
+    volc_stats.py store.json update ../data/222100
+    volc_stats.py store.json remove ../data/222100
+    volc_stats.py store.json json
+"""
+
+import os
+import json
+
+from volc_def import Volcano, study_terms
+
+class VolcanoStats:
+    """ Incrementally maintained counts over many volcanoes """
+
+    # The categories we count, in the order they are reported
+    categories = ["region", "country", "rocktype", "typev",
+                  "study_type", "study_year"]
+
+    def __init__(self):
+        # totals[category][value] is the number of volcanoes
+        # (or studies for the study_* categories) with that
+        # value. contributions[id] holds the values that
+        # volcano added so we can take them away again, and
+        # sources[id] the file it came from.
+        self.totals = {}
+        for category in self.categories:
+            self.totals[category] = {}
+        self.volcanoes = 0
+        self.studies = 0
+        self.events = 0
+        self.contributions = {}
+        self.sources = {}
+
+    def _contribution(self, volcano):
+        # Work out what a single volcano adds to the totals.
+        # This is the only place that looks inside a Volcano.
+        contrib = {"studies": len(volcano.studies),
+                   "events": len(volcano.events)}
+        for category in ["region", "country", "rocktype", "typev"]:
+            value = getattr(volcano, category)
+            if value is None:
+                contrib[category] = []
+            else:
+                contrib[category] = [value]
+        contrib["study_type"] = []
+        contrib["study_year"] = []
+        for study in volcano.studies:
+            # Split e.g. 'ERS1/ERS2, Envisat and InSAR' so that
+            # each sensor or method is counted on its own, as
+            # in volc_index.
+            if study.type is not None:
+                contrib["study_type"].extend(sorted(study_terms(study.type)))
+            # A study counts once for every year it covers
+            if study.startdate is not None:
+                if study.enddate is not None:
+                    end_year = study.enddate.year
+                else:
+                    end_year = study.startdate.year
+                for year in range(study.startdate.year, end_year+1):
+                    contrib["study_year"].append(str(year))
+        return contrib
+
+    def _apply(self, contrib, sign):
+        self.volcanoes = self.volcanoes + sign
+        self.studies = self.studies + sign*contrib["studies"]
+        self.events = self.events + sign*contrib["events"]
+        for category in self.categories:
+            counts = self.totals[category]
+            for value in contrib[category]:
+                counts[value] = counts.get(value, 0) + sign
+                if counts[value] == 0:
+                    del counts[value]
+
+    def add(self, volcano, filename=None):
+        """ Add a volcano, replacing any earlier version with the same ID """
+        if volcano.id is None:
+            raise Exception("Cannot count a volcano without an ID")
+        if volcano.id in self.contributions:
+            self.remove(volcano.id)
+        contrib = self._contribution(volcano)
+        self._apply(contrib, 1)
+        self.contributions[volcano.id] = contrib
+        if filename is not None:
+            # The same file may be named from anywhere
+            filename = os.path.abspath(filename)
+        self.sources[volcano.id] = filename
+
+    def remove(self, volc_id):
+        """ Take a volcano (given by ID) out of the totals """
+        if volc_id not in self.contributions:
+            raise Exception("Volcano " + volc_id + " is not counted")
+        self._apply(self.contributions[volc_id], -1)
+        del self.contributions[volc_id]
+        del self.sources[volc_id]
+
+    def remove_file(self, filename):
+        """ Take out whatever volcano was read from filename """
+        filename = os.path.abspath(filename)
+        for (volc_id, source) in self.sources.items():
+            if source == filename:
+                self.remove(volc_id)
+                return volc_id
+        raise Exception("No volcano was read from " + filename)
+
+    def update_file(self, filename):
+        """ Add, or re-read, the volcano in filename
+
+        Returns its ID, or None if the file has no ID.
+        """
+        # The ID may have been edited, so first drop
+        # anything that came from this file.
+        filename = os.path.abspath(filename)
+        for (volc_id, source) in self.sources.items():
+            if source == filename:
+                self.remove(volc_id)
+        volcano = Volcano(filename=filename)
+        # A file without an ID, e.g. a README, is not a volcano
+        if volcano.id is not None:
+            self.add(volcano, filename=filename)
+        return volcano.id
+
+    def summary(self):
+        """ The totals as a dictionary, suitable for the website """
+        summary = {"volcanoes": self.volcanoes,
+                   "studies": self.studies,
+                   "events": self.events}
+        for category in self.categories:
+            summary[category] = self.totals[category]
+        return summary
+
+    def to_json(self):
+        return json.dumps(self.summary(), sort_keys=True, indent=2)
+
+    def save(self, filename):
+        """ Write the totals and per volcano contributions to filename """
+        store = self.summary()
+        store["contributions"] = self.contributions
+        store["sources"] = self.sources
+        tmpname = filename + ".tmp"
+        f = open(tmpname, 'w')
+        json.dump(store, f, sort_keys=True, indent=2)
+        f.close()
+        os.rename(tmpname, filename)
+
+    def load(self, filename):
+        """ Read back a store written by save() """
+        f = open(filename, 'r')
+        store = json.load(f)
+        f.close()
+        self.volcanoes = store["volcanoes"]
+        self.studies = store["studies"]
+        self.events = store["events"]
+        for category in self.categories:
+            self.totals[category] = store[category]
+        self.contributions = store["contributions"]
+        self.sources = store["sources"]
+
+if __name__=="__main__":
+    import sys
+    store = sys.argv[1]
+    mode = sys.argv[2]
+    stats = VolcanoStats()
+    if os.path.exists(store):
+        stats.load(store)
+    for file in sys.argv[3:]:
+        if mode == "update":
+            stats.update_file(file)
+        if mode == "remove":
+            stats.remove_file(file)
+    if mode == "json":
+        print stats.to_json()
+    else:
+        stats.save(store)